@@ -6,21 +6,86 @@ Terminal-based interface without Streamlit
 
 import os
 import asyncio
-import pandas as pd
-from sqlalchemy import create_engine, text
+import datetime
+import hashlib
+import itertools
+import json
+import sqlite3
+from sqlalchemy import text
 import nest_asyncio
 
 # Import our modules
-from tools import setup_document_tool, setup_sql_tool
-from workflow import RouterOutputAgentWorkflow
-
-# Apply nest_asyncio for asyncio compatibility
-nest_asyncio.apply()
+from tools import (
+    clear_schema_cache,
+    create_sqlite_engine,
+    get_directory_manifest,
+    get_embed_model_signature,
+    setup_document_tool,
+    setup_sql_tool,
+)
+from workflow import FALLBACK_RESPONSES, RouterOutputAgentWorkflow, is_failed_tool_message
+from semantic_cache import SemanticCache
 
 # LlamaIndex imports
 from llama_index.core import Settings
 from llama_index.llms.openrouter import OpenRouter
 from llama_index.embeddings.huggingface import HuggingFaceEmbedding
+import torch
+
+# Apply nest_asyncio for asyncio compatibility
+nest_asyncio.apply()
+
+# Excel ingest settings
+INGEST_BATCH_SIZE = 10_000
+
+# Text columns whose distinct/total ratio exceeds this get a lookup index
+LOOKUP_INDEX_MIN_CARDINALITY = 0.5
+
+# Document types the document tool can index
+SUPPORTED_DOCUMENT_EXTENSIONS = {"pdf", "docx", "pptx", "txt"}
+
+# Embedding model, texts embedded per forward pass, and its optional ONNX export
+EMBED_MODEL_NAME = "BAAI/bge-small-en-v1.5"
+EMBED_BATCH_SIZE = 128
+GPU_EMBED_BATCH_SIZE = 256
+ONNX_MODEL_DIR = "bge_onnx"
+
+
+def configure_torch_threads():
+    """Leave CPU headroom for the parallel document parser"""
+    torch.set_num_threads(max(1, (os.cpu_count() or 2) // 2))
+    try:
+        torch.set_num_interop_threads(2)
+    except RuntimeError:
+        # Only allowed before torch has started any parallel work
+        pass
+
+
+def quantize_embed_model(embed_model):
+    """Swap the embedder's linear layers for dynamically quantized INT8 ones"""
+    try:
+        embed_model._model = torch.ao.quantization.quantize_dynamic(
+            embed_model._model, {torch.nn.Linear}, dtype=torch.qint8
+        )
+    except Exception as e:
+        print(f"⚠️ INT8 quantization unavailable, using FP32 embeddings: {e}")
+
+
+def load_onnx_embed_model():
+    """Use the ONNX Runtime export of the embedding model on CPU, if present"""
+    try:
+        from onnx_embedding import OnnxEmbedding, find_onnx_model
+        
+        if find_onnx_model(ONNX_MODEL_DIR) is None:
+            return None
+        return OnnxEmbedding(
+            ONNX_MODEL_DIR,
+            model_name=EMBED_MODEL_NAME,
+            embed_batch_size=EMBED_BATCH_SIZE,
+        )
+    except Exception as e:
+        print(f"⚠️ ONNX embedding unavailable, using PyTorch: {e}")
+        return None
 
 
 def initialize_models():
@@ -37,7 +102,30 @@ def initialize_models():
     try:
         # Initialize LLM and embedding model - using a more capable model for better tool selection
         llm = OpenRouter(model="anthropic/claude-3.5-sonnet", api_key=api_key)
-        embed_model = HuggingFaceEmbedding(model_name="BAAI/bge-small-en-v1.5")
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+        configure_torch_threads()
+        
+        # On CPU prefer the ONNX Runtime export, then INT8-quantized PyTorch
+        embed_model = load_onnx_embed_model() if device == "cpu" else None
+        if embed_model is not None:
+            device = "cpu (ONNX Runtime)"
+        else:
+            embed_model = HuggingFaceEmbedding(
+                model_name=EMBED_MODEL_NAME,
+                embed_batch_size=GPU_EMBED_BATCH_SIZE if device == "cuda" else EMBED_BATCH_SIZE,
+                device=device,
+                trust_remote_code=False,
+                # Half precision on GPU, FP32 weights on CPU (quantized below)
+                model_kwargs={"torch_dtype": torch.float16} if device == "cuda" else {},
+            )
+            if device == "cpu":
+                quantize_embed_model(embed_model)
+        
+        # Warm up now so the first real batch doesn't pay for lazy initialization
+        embed_model.get_text_embedding("warmup")
+        if device == "cuda":
+            torch.cuda.synchronize()
+        print(f"✓ Embedding model running on: {device}")
         
         # Set global settings
         Settings.llm = llm
@@ -50,31 +138,239 @@ def initialize_models():
         raise
 
 
-def excel_to_sqlite(excel_path, db_path="database.sqlite", table_name="data"):
+def get_excel_engine(excel_path):
+    """Pick the fastest available pandas engine for an Excel file"""
+    try:
+        # Rust-backed parser, much faster than openpyxl and also reads .xls/.xlsb
+        import python_calamine  # noqa: F401
+        return "calamine"
+    except ImportError:
+        return "xlrd" if excel_path.lower().endswith(".xls") else "openpyxl"
+
+
+def _quote_identifier(name):
+    """Quote a table/column name for use in SQLite statements"""
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+def _header_names(header_row):
+    """Build unique column names from the sheet header, the way pandas does"""
+    names = []
+    seen = {}
+    for i, value in enumerate(header_row):
+        name = str(_sqlite_value(value)) if value not in (None, "") else f"Unnamed: {i}"
+        # Mirrors pandas' _dedup_names: a suffixed name may itself be taken
+        # (e.g. "a", "a", "a.1"), so keep suffixing until it is unused
+        count = seen.get(name, 0)
+        while count > 0:
+            seen[name] = count + 1
+            name = f"{name}.{count}"
+            count = seen.get(name, 0)
+        seen[name] = count + 1
+        names.append(name)
+    return names
+
+
+def _sqlite_value(value):
+    """Convert a calamine cell value into something sqlite3 can store"""
+    if isinstance(value, str):
+        return value if value != "" else None
+    # calamine reads every xlsx number as a float; like pandas and openpyxl,
+    # turn whole numbers back into ints so IDs and phone numbers stay INTEGER
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    if isinstance(value, datetime.datetime):
+        return value.isoformat(sep=" ")
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, datetime.timedelta):
+        return str(value)
+    return value
+
+
+def _infer_sqlite_type(values):
+    """Infer a SQLite column type from a sample of column values"""
+    kinds = {type(v) for v in values if v is not None}
+    if kinds and kinds <= {bool, int}:
+        return "INTEGER"
+    if kinds and kinds <= {bool, int, float}:
+        return "REAL"
+    return "TEXT"
+
+
+def _next_batch(rows, width):
+    """Read the next batch of rows, padded/truncated to the header width"""
+    batch = []
+    for row in itertools.islice(rows, INGEST_BATCH_SIZE):
+        values = [_sqlite_value(v) for v in row[:width]]
+        values.extend([None] * (width - len(values)))
+        batch.append(values)
+    return batch
+
+
+def _stream_excel_to_sqlite(excel_path, engine, table_name):
+    """Stream the first sheet into SQLite in batches, without building a DataFrame"""
+    from python_calamine import CalamineWorkbook
+
+    workbook = CalamineWorkbook.from_path(excel_path)
+    rows = workbook.get_sheet_by_index(0).iter_rows()
+    header = next(rows, None)
+    if header is None:
+        raise ValueError(f"Excel sheet is empty: {excel_path}")
+
+    names = _header_names(header)
+    width = len(names)
+    table = _quote_identifier(table_name)
+
+    # Raw sqlite3 connection from the pool (PRAGMAs are applied on connect)
+    raw_conn = engine.raw_connection()
+    conn = raw_conn.driver_connection
+    try:
+        # Column types come from the first batch; SQLite is lenient about the rest
+        batch = _next_batch(rows, width)
+        types = [_infer_sqlite_type(col) for col in zip(*batch)] if batch else ["TEXT"] * width
+        column_defs = ", ".join(f"{_quote_identifier(n)} {t}" for n, t in zip(names, types))
+        insert_sql = f"INSERT INTO {table} VALUES ({', '.join('?' * width)})"
+
+        row_count = 0
+        conn.execute("BEGIN")
+        conn.execute(f"DROP TABLE IF EXISTS {table}")
+        conn.execute(f"CREATE TABLE {table} ({column_defs})")
+        while batch:
+            conn.executemany(insert_sql, batch)
+            row_count += len(batch)
+            batch = _next_batch(rows, width)
+        conn.execute("COMMIT")
+    except Exception:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        raise
+    finally:
+        raw_conn.close()
+
+    return list(zip(names, types)), row_count
+
+
+def _pandas_excel_to_sqlite(excel_path, engine, table_name):
+    """Load the first sheet with pandas and write it with to_sql"""
+    # Only needed without calamine, so don't pay for the import otherwise
+    import pandas as pd
+
+    df = pd.read_excel(excel_path, sheet_name=0, engine=get_excel_engine(excel_path))
+    
+    # Multi-row INSERTs, sized to stay under SQLite's bound-parameter limit
+    max_params = 32766 if sqlite3.sqlite_version_info >= (3, 32, 0) else 999
+    chunksize = max(1, min(INGEST_BATCH_SIZE, max_params // max(1, len(df.columns))))
+    with engine.begin() as conn:
+        df.to_sql(
+            table_name, conn, if_exists='replace', index=False,
+            method='multi', chunksize=chunksize,
+        )
+    return [(col, str(df[col].dtype)) for col in df.columns], len(df)
+
+
+def _create_lookup_indexes(engine, table_name):
+    """Index high-cardinality text columns that generated SQL is likely to filter on"""
+    table = _quote_identifier(table_name)
+    indexed = []
+    # exec_driver_sql: column names may contain ':' which text() would treat as binds
+    with engine.begin() as conn:
+        row_count = conn.exec_driver_sql(f"SELECT COUNT(*) FROM {table}").scalar()
+        if not row_count:
+            return indexed
+        
+        for col in conn.exec_driver_sql(f"PRAGMA table_info({table})").fetchall():
+            name, col_type = col[1], (col[2] or "").upper()
+            if not any(t in col_type for t in ("CHAR", "CLOB", "TEXT")):
+                continue
+            
+            column = _quote_identifier(name)
+            distinct = conn.exec_driver_sql(f"SELECT COUNT(DISTINCT {column}) FROM {table}").scalar()
+            if distinct / row_count > LOOKUP_INDEX_MIN_CARDINALITY:
+                # BINARY index serves "=" / IN; the NOCASE one serves LIKE 'prefix%'
+                index = _quote_identifier(f"idx_{table_name}_{name}")
+                nocase_index = _quote_identifier(f"idx_{table_name}_{name}_nocase")
+                conn.exec_driver_sql(
+                    f"CREATE INDEX IF NOT EXISTS {index} ON {table} ({column})"
+                )
+                conn.exec_driver_sql(
+                    f"CREATE INDEX IF NOT EXISTS {nocase_index} ON {table} ({column} COLLATE NOCASE)"
+                )
+                indexed.append(name)
+        
+        # Give the query planner statistics for the new indexes
+        conn.exec_driver_sql(f"ANALYZE {table}")
+    return indexed
+
+
+def _ingest_key(excel_path, table_name):
+    """Identify an Excel source by path, target table, mtime and size"""
+    stat = os.stat(excel_path)
+    return f"{os.path.abspath(excel_path)}|{table_name}|{stat.st_mtime}-{stat.st_size}"
+
+
+def _cached_columns(db_path, table_name, key, engine):
+    """Return the table's columns if the database was built from the same source"""
+    meta_path = f"{db_path}.meta"
+    if not (os.path.exists(db_path) and os.path.exists(meta_path)):
+        return None
+    with open(meta_path, encoding="utf-8") as f:
+        if f.read().strip() != key:
+            return None
+
+    with engine.connect() as conn:
+        rows = conn.execute(text(f"PRAGMA table_info({_quote_identifier(table_name)})")).fetchall()
+    return [row[1] for row in rows] or None
+
+
+def excel_to_sqlite(excel_path, db_path="database.sqlite", table_name="data", engine=None):
     """Convert Excel file to SQLite database"""
     print(f"Converting Excel file: {excel_path}")
     
     if not os.path.exists(excel_path):
         raise FileNotFoundError(f"Excel file not found: {excel_path}")
     
+    engine = engine or create_sqlite_engine(db_path)
+    
+    # Skip the conversion if the database already matches this Excel file
+    meta_path = f"{db_path}.meta"
+    key = _ingest_key(excel_path, table_name)
+    cached_columns = _cached_columns(db_path, table_name, key, engine)
+    if cached_columns:
+        print(f"✓ Excel file unchanged, reusing database: {db_path}")
+        return db_path, table_name, cached_columns
+    
     try:
-        # Read Excel file
-        df = pd.read_excel(excel_path)
-        print(f"✓ Loaded Excel with {len(df)} rows and {len(df.columns)} columns")
+        # Invalidate the old marker so a failed conversion is never reused
+        if os.path.exists(meta_path):
+            os.remove(meta_path)
+        
+        # Stream rows straight into SQLite when calamine is available
+        if get_excel_engine(excel_path) == "calamine":
+            columns, row_count = _stream_excel_to_sqlite(excel_path, engine, table_name)
+        else:
+            columns, row_count = _pandas_excel_to_sqlite(excel_path, engine, table_name)
+        print(f"✓ Loaded Excel with {row_count} rows and {len(columns)} columns")
         
         # Display column info
         print("Columns found:")
-        for i, col in enumerate(df.columns):
-            print(f"  {i+1}. {col} ({df[col].dtype})")
-        
-        # Create SQLite database
-        engine = create_engine(f"sqlite:///{db_path}")
-        df.to_sql(table_name, engine, if_exists='replace', index=False)
+        for i, (col, col_type) in enumerate(columns):
+            print(f"  {i+1}. {col} ({col_type})")
         
         print(f"✓ Database created: {db_path}")
         print(f"✓ Table created: {table_name}")
         
-        return db_path, table_name, df.columns.tolist()
+        indexed = _create_lookup_indexes(engine, table_name)
+        if indexed:
+            print(f"✓ Indexed lookup columns: {', '.join(indexed)}")
+        
+        with open(meta_path, "w", encoding="utf-8") as f:
+            f.write(key)
+        
+        # The table was replaced, so any cached schema is stale
+        clear_schema_cache()
+        
+        return db_path, table_name, [col for col, _ in columns]
         
     except Exception as e:
         print(f"✗ Error converting Excel to SQLite: {e}")
@@ -82,7 +378,7 @@ def excel_to_sqlite(excel_path, db_path="database.sqlite", table_name="data"):
 
 
 def get_document_path():
-    """Get document directory path from user"""
+    """Get document directory path and its supported files from user"""
     while True:
         doc_path = input("Enter the path to your documents directory: ").strip()
         if not doc_path:
@@ -97,11 +393,14 @@ def get_document_path():
             print(f"✗ Path is not a directory: {doc_path}")
             continue
         
-        # Check for supported files
-        supported_files = []
-        for file in os.listdir(doc_path):
-            if file.lower().endswith(('.pdf', '.docx', '.pptx', '.txt')):
-                supported_files.append(file)
+        # Check for supported files (DirEntry avoids an extra stat per file)
+        with os.scandir(doc_path) as entries:
+            supported_files = sorted(
+                entry.name for entry in entries
+                if not entry.name.startswith(".")
+                and entry.is_file(follow_symlinks=False)
+                and entry.name.rpartition(".")[2].lower() in SUPPORTED_DOCUMENT_EXTENSIONS
+            )
         
         if not supported_files:
             print(f"✗ No supported files found in {doc_path}")
@@ -114,38 +413,58 @@ def get_document_path():
         if len(supported_files) > 5:
             print(f"  ... and {len(supported_files) - 5} more files")
         
-        return doc_path
+        return doc_path, supported_files
 
 
-async def process_query(query, workflow):
+def get_cache_namespace(excel_path, table_name, doc_path, doc_files, embed_model):
+    """Fingerprint the data sources and embedder so cached answers never outlive them"""
+    sources = {
+        "excel": _ingest_key(excel_path, table_name),
+        "documents": get_directory_manifest(doc_path, doc_files),
+        # Query vectors from a different backend/precision are not comparable
+        "embed_model": get_embed_model_signature(embed_model),
+    }
+    return hashlib.sha256(json.dumps(sources, sort_keys=True).encode()).hexdigest()
+
+
+async def process_query(query, workflow, cache=None):
     """Process a query using the workflow"""
     try:
         print(f"\n🔍 Processing: {query}")
-        print("⏳ Please wait...")
         
-        # Don't clear chat history - keep system context
-        # Only clear if we have too many messages to avoid token limits
-        if len(workflow.chat_history) > 20:
-            # Keep system message and clear the rest
-            system_msg = workflow.chat_history[0] if workflow.chat_history and workflow.chat_history[0].role == "system" else None
-            workflow.chat_history = [system_msg] if system_msg else []
+        # Cached answers are keyed on the query alone, so skip follow-ups that
+        # depend on the conversation (e.g. "and her email?")
+        use_cache = cache is not None and workflow.is_standalone_query(query)
+        
+        # Answer near-duplicate questions from the semantic cache
+        cached = cache.lookup(query) if use_cache else None
+        if cached is not None:
+            # Keep the exchange in history so follow-ups still have context
+            workflow.add_exchange(query, cached)
+            print("⚡ Answered from cache")
+            print(f"📝 Response:\n{cached}")
+            return cached
+        
+        print("⏳ Please wait...")
         
         # Run the workflow
         result = await asyncio.wait_for(workflow.run(message=query), timeout=60.0)
         
-        # Extract tool usage information
+        # Extract tool usage information for this query
         tools_used = []
         tool_names_seen = set()
-        for msg in workflow.chat_history:
+        tool_failed = False
+        for msg in workflow.current_turn_messages():
             if msg.role == "tool" and hasattr(msg, 'additional_kwargs'):
                 tool_name = msg.additional_kwargs.get('tool_used', 'Unknown')
-                if "cancelled" not in msg.content.lower() and "error" not in msg.content.lower():
-                    if tool_name not in tool_names_seen:
-                        tools_used.append({
-                            'name': tool_name,
-                            'response': msg.content
-                        })
-                        tool_names_seen.add(tool_name)
+                if is_failed_tool_message(msg):
+                    tool_failed = True
+                elif tool_name not in tool_names_seen:
+                    tools_used.append({
+                        'name': tool_name,
+                        'response': msg.content
+                    })
+                    tool_names_seen.add(tool_name)
         
         # Format response
         if tools_used:
@@ -154,6 +473,15 @@ async def process_query(query, workflow):
             print(f"📝 Response:\n{result}")
         else:
             print(f"📝 Response:\n{result}")
+        
+        # Only cache answers backed by tool calls that all succeeded
+        if (
+            use_cache
+            and tools_used
+            and not tool_failed
+            and str(result) not in FALLBACK_RESPONSES
+        ):
+            cache.add(query, str(result))
             
         return result
         
@@ -167,10 +495,10 @@ async def process_query(query, workflow):
         return error_msg
 
 
-def display_database_info(db_path, table_name):
+def display_database_info(db_path, table_name, engine=None):
     """Display information about the database"""
     try:
-        engine = create_engine(f"sqlite:///{db_path}")
+        engine = engine or create_sqlite_engine(db_path)
         
         # Get table info
         with engine.connect() as conn:
@@ -193,9 +521,12 @@ def display_database_info(db_path, table_name):
                 print(f"  - {col[1]} ({col[2]})")
                 
             # Show sample data
-            sample_df = pd.read_sql_query(f"SELECT * FROM {table_name} LIMIT 3", engine)
+            rows = conn.execute(
+                text(f"SELECT * FROM {_quote_identifier(table_name)} LIMIT 3")
+            ).fetchall()
             print(f"\n📄 Sample Data:")
-            print(sample_df.to_string(index=False))
+            print("  ".join(col[1] for col in columns))
+            print("\n".join("  ".join(map(str, row)) for row in rows))
             
     except Exception as e:
         print(f"❌ Error displaying database info: {e}")
@@ -227,26 +558,37 @@ def main():
             
             break
         
+        # One pooled engine shared by the ingest, the SQL tool and the info display
+        db_path = "database.sqlite"
+        engine = create_sqlite_engine(db_path)
+        
         # Convert Excel to SQLite
-        db_path, table_name, columns = excel_to_sqlite(excel_path)
+        db_path, table_name, columns = excel_to_sqlite(excel_path, db_path, engine=engine)
         
         # Get document directory
-        doc_path = get_document_path()
+        doc_path, doc_files = get_document_path()
         
         # Setup tools
         print("\n🔧 Setting up tools...")
-        sql_tool = setup_sql_tool(db_path, table_name)
-        doc_tool = setup_document_tool(doc_path)
+        sql_tool = setup_sql_tool(db_path, table_name, engine=engine)
+        doc_tool = setup_document_tool(doc_path, input_files=doc_files)
         tools = [sql_tool, doc_tool]
         print("✓ Tools ready!")
         
         # Initialize workflow
         print("🔄 Initializing workflow...")
         workflow = RouterOutputAgentWorkflow(tools=tools, verbose=False, timeout=120)
+        cache = SemanticCache(
+            embed_model,
+            persist_path="semantic_cache",
+            namespace=get_cache_namespace(
+                excel_path, table_name, doc_path, doc_files, embed_model
+            ),
+        )
         print("✓ Workflow ready!")
         
         # Display database info
-        display_database_info(db_path, table_name)
+        display_database_info(db_path, table_name, engine=engine)
         
         # Start interactive loop
         print(f"\n💬 Interactive Query Mode")
@@ -268,7 +610,7 @@ def main():
                     break
                 
                 # Process the query
-                response = asyncio.run(process_query(query, workflow))
+                response = asyncio.run(process_query(query, workflow, cache))
                 
             except KeyboardInterrupt:
                 print("\n\n👋 Goodbye!")
@@ -276,6 +618,8 @@ def main():
             except Exception as e:
                 print(f"❌ Unexpected error: {e}")
                 continue
+        
+        cache.save()
                 
     except Exception as e:
         print(f"❌ Fatal error: {e}")
@@ -0,0 +1,101 @@
+"""
+ONNX Runtime embedding model for RAG + SQL hybrid system
+CPU inference for a sentence-transformer exported with optimum-cli
+"""
+
+import os
+from typing import Any, List, Optional
+
+import numpy as np
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.embeddings.huggingface.utils import format_query, format_text
+
+
+# File names optimum-cli may give the exported model, most optimized first
+ONNX_MODEL_FILES = ("model_optimized.onnx", "model.onnx")
+
+
+def find_onnx_model(onnx_dir: str) -> Optional[str]:
+    """Return the path of the exported model in a directory, if there is one."""
+    for file_name in ONNX_MODEL_FILES:
+        path = os.path.join(onnx_dir, file_name)
+        if os.path.exists(path):
+            return path
+    return None
+
+
+class OnnxEmbedding(BaseEmbedding):
+    """BGE-style embeddings (CLS pooling, L2-normalized) computed with ONNX Runtime."""
+
+    onnx_dir: str
+    max_length: int = 512
+
+    _session: Any = PrivateAttr()
+    _tokenizer: Any = PrivateAttr()
+    _input_names: Any = PrivateAttr()
+
+    def __init__(
+        self,
+        onnx_dir: str,
+        model_name: str = "BAAI/bge-small-en-v1.5",
+        max_length: int = 512,
+        **kwargs: Any,
+    ):
+        """Load the exported model and its tokenizer from onnx_dir."""
+        super().__init__(
+            model_name=model_name, onnx_dir=onnx_dir, max_length=max_length, **kwargs
+        )
+
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        model_path = find_onnx_model(onnx_dir)
+        if model_path is None:
+            raise FileNotFoundError(f"No exported ONNX model found in: {onnx_dir}")
+
+        sess_options = ort.SessionOptions()
+        sess_options.intra_op_num_threads = os.cpu_count() or 1
+        sess_options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self._session = ort.InferenceSession(
+            model_path, sess_options=sess_options, providers=["CPUExecutionProvider"]
+        )
+        self._input_names = [node.name for node in self._session.get_inputs()]
+        self._tokenizer = AutoTokenizer.from_pretrained(onnx_dir)
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "OnnxEmbedding"
+
+    def _embed(self, texts: List[str]) -> List[List[float]]:
+        """Embed a batch of already-formatted texts."""
+        encoded = self._tokenizer(
+            texts,
+            padding=True,
+            truncation=True,
+            max_length=self.max_length,
+            return_tensors="np",
+        )
+        inputs = {
+            name: encoded[name].astype(np.int64)
+            for name in self._input_names
+            if name in encoded
+        }
+        last_hidden_state = self._session.run(None, inputs)[0]
+
+        # CLS pooling followed by L2 normalization, as HuggingFaceEmbedding does for bge
+        pooled = last_hidden_state[:, 0]
+        norms = np.linalg.norm(pooled, axis=1, keepdims=True)
+        return (pooled / np.maximum(norms, 1e-12)).tolist()
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        return self._embed([format_query(query, self.model_name)])[0]
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        return self._get_query_embedding(query)
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        return self._embed([format_text(text, self.model_name)])[0]
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        return self._embed([format_text(text, self.model_name) for text in texts])
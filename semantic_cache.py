@@ -0,0 +1,178 @@
+"""
+Semantic response cache for RAG + SQL hybrid system
+Answers near-duplicate questions without another LLM + tool round-trip
+"""
+
+import json
+import os
+import re
+from typing import List, Optional
+
+import numpy as np
+
+try:
+    import faiss
+except ImportError:
+    faiss = None
+
+
+# Terms that identify what a query is about: numbers, "quoted" strings and
+# capitalized words (names). Queries that embed alike but differ in one of
+# these (e.g. "Paula Walker" vs "Paula Walters") must not share an answer.
+KEY_TERM_PATTERN = re.compile(r'"[^"]*"|\d+(?:\.\d+)?|\b[A-Z][\w-]*')
+
+
+def key_terms(query: str) -> frozenset:
+    """Return the identifying terms of a query, ignoring a capitalized first word."""
+    terms = set()
+    for match in KEY_TERM_PATTERN.finditer(query.strip()):
+        term = match.group()
+        if match.start() == 0 and term[0].isupper():
+            continue
+        terms.add(term)
+    return frozenset(terms)
+
+
+class SemanticCache:
+    """LRU cache of responses keyed by query embedding similarity."""
+
+    def __init__(
+        self,
+        embed_model,
+        threshold: float = 0.95,
+        max_entries: int = 256,
+        persist_path: Optional[str] = None,
+        namespace: str = "",
+    ):
+        """Initialize the cache, loading a persisted one for the same namespace."""
+        self.embed_model = embed_model
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.persist_path = persist_path
+        # Identifies the data the answers came from; a mismatch discards the saved cache
+        self.namespace = namespace
+        self.enabled = faiss is not None
+
+        self._index = None
+        self._queries: List[str] = []
+        self._responses: List[str] = []
+        self._last_used: List[int] = []
+        self._clock = 0
+        self._last_embedding = None
+
+        if self.enabled and persist_path:
+            try:
+                self._load()
+            except Exception as e:
+                print(f"⚠️ Could not load semantic cache: {e}")
+                self.clear()
+
+    def __len__(self) -> int:
+        return len(self._responses)
+
+    def clear(self) -> None:
+        """Drop all cached entries."""
+        self._index = None
+        self._queries = []
+        self._responses = []
+        self._last_used = []
+
+    def lookup(self, query: str) -> Optional[str]:
+        """Return the cached response for a similar enough query, if any."""
+        if not self.enabled:
+            return None
+
+        vector = self._embed(query)
+        if not self._responses:
+            return None
+
+        scores, ids = self._index.search(vector, 1)
+        position = int(ids[0][0])
+        if position < 0 or scores[0][0] < self.threshold:
+            return None
+        # Similarity alone can't tell apart queries about different people or IDs
+        if key_terms(query) != key_terms(self._queries[position]):
+            return None
+
+        self._last_used[position] = self._tick()
+        return self._responses[position]
+
+    def add(self, query: str, response: str) -> None:
+        """Store the response for a query, evicting the least recently used entry."""
+        if not self.enabled:
+            return
+
+        vector = self._embed(query)
+        if self._index is None:
+            self._index = faiss.IndexFlatIP(vector.shape[1])
+
+        if len(self._responses) >= self.max_entries:
+            self._evict()
+
+        self._index.add(vector)
+        self._queries.append(query)
+        self._responses.append(response)
+        self._last_used.append(self._tick())
+
+    def save(self) -> None:
+        """Persist the cache next to persist_path (.faiss index + .json entries)."""
+        if not (self.enabled and self.persist_path and self._index is not None):
+            return
+
+        faiss.write_index(self._index, f"{self.persist_path}.faiss")
+        with open(f"{self.persist_path}.json", "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "namespace": self.namespace,
+                    "queries": self._queries,
+                    "responses": self._responses,
+                },
+                f,
+            )
+
+    def _load(self) -> None:
+        """Load a persisted cache if it belongs to the same namespace."""
+        index_path = f"{self.persist_path}.faiss"
+        entries_path = f"{self.persist_path}.json"
+        if not (os.path.exists(index_path) and os.path.exists(entries_path)):
+            return
+
+        with open(entries_path, encoding="utf-8") as f:
+            entries = json.load(f)
+        if entries.get("namespace") != self.namespace:
+            return
+
+        index = faiss.read_index(index_path)
+        # An interrupted save can leave the two files out of step; don't pair
+        # responses with the wrong vectors
+        if not (index.ntotal == len(entries["responses"]) == len(entries["queries"])):
+            print("⚠️ Semantic cache files don't match, starting with an empty cache")
+            return
+
+        self._index = index
+        self._queries = entries["queries"]
+        self._responses = entries["responses"]
+        self._last_used = [self._tick() for _ in self._responses]
+
+    def _embed(self, query: str) -> np.ndarray:
+        """Embed a query as a normalized float32 row, reusing the last result."""
+        if self._last_embedding is not None and self._last_embedding[0] == query:
+            return self._last_embedding[1]
+
+        vector = np.asarray([self.embed_model.get_query_embedding(query)], dtype="float32")
+        faiss.normalize_L2(vector)
+        self._last_embedding = (query, vector)
+        return vector
+
+    def _evict(self) -> None:
+        """Remove the least recently used entry."""
+        position = int(np.argmin(self._last_used))
+        # IndexFlat compacts on removal, so positions stay aligned with the lists
+        self._index.remove_ids(np.array([position], dtype="int64"))
+        del self._queries[position]
+        del self._responses[position]
+        del self._last_used[position]
+
+    def _tick(self) -> int:
+        self._clock += 1
+        return self._clock
@@ -1,45 +1,118 @@
 """
 Tool setup functions for RAG + SQL hybrid system
-Simplified version without Codex and using simple vector store
+Simplified version without Codex, using a FAISS vector store when available
 """
 
 import os
+import asyncio
+import json
 import uuid
-from sqlalchemy import create_engine
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.pool import QueuePool
 from llama_index.core import (
+    Settings,
     VectorStoreIndex,
     SimpleDirectoryReader,
     SQLDatabase,
     PromptTemplate,
     StorageContext,
+    load_index_from_storage,
 )
 from llama_index.core.query_engine import NLSQLTableQueryEngine
-from llama_index.core.tools import QueryEngineTool, FunctionTool
+from llama_index.core.tools import FunctionTool
 from llama_index.core.node_parser import MarkdownNodeParser
+from llama_index.core.readers.file.base import default_file_metadata_func
+from llama_index.core.schema import MetadataMode
 from llama_index.readers.docling import DoclingReader
 from llama_index.core.vector_stores import SimpleVectorStore
 
+try:
+    import faiss
+    from llama_index.vector_stores.faiss import FaissVectorStore
+except ImportError:
+    faiss = None
 
 
-def setup_sql_tool(db_path="database.sqlite", table_name="data"):
+# Applied to every new SQLite connection
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-262144",
+)
+
+# File types converted by Docling; everything else uses the default readers
+DOCLING_EXTENSIONS = {".pdf", ".docx", ".pptx"}
+
+# Each Docling worker runs its own torch models, so keep the pool small
+DOCLING_MAX_WORKERS = 4
+
+# File metadata SimpleDirectoryReader hides from embeddings and LLM prompts
+# (only file_path stays visible as context for the chunks)
+EXCLUDED_FILE_METADATA_KEYS = [
+    "file_name",
+    "file_type",
+    "file_size",
+    "creation_date",
+    "last_modified_date",
+    "last_accessed_date",
+]
+
+# Name of the file describing which sources a persisted index was built from
+MANIFEST_FILE = "manifest.json"
+
+# Vector store backend and the corpus size above which FAISS switches to HNSW
+VECTOR_STORE_BACKEND = "faiss" if faiss is not None else "simple"
+HNSW_MIN_NODES = 50_000
+
+
+
+def create_sqlite_engine(db_path="database.sqlite"):
+    """Create a pooled SQLAlchemy engine shared by everything using the database."""
+    engine = create_engine(
+        f"sqlite:///{db_path}",
+        poolclass=QueuePool,
+        pool_size=5,
+        max_overflow=10,
+        pool_pre_ping=True,
+        pool_recycle=3600,
+        # Async tool calls may use pooled connections from worker threads
+        connect_args={"check_same_thread": False},
+    )
+
+    @event.listens_for(engine, "connect")
+    def apply_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma in SQLITE_PRAGMAS:
+            cursor.execute(pragma)
+        cursor.close()
+
+    return engine
+
+
+def setup_sql_tool(db_path="database.sqlite", table_name="data", engine=None):
     """Setup SQL query tool for querying database."""
     # Validate database exists
     if not os.path.exists(db_path):
         raise FileNotFoundError(f"Database file not found: {db_path}")
 
     try:
-        engine = create_engine(f"sqlite:///{db_path}")
+        engine = engine or create_sqlite_engine(db_path)
         sql_database = SQLDatabase(engine)
         print(f"✓ Connected to database: {db_path}")
     except Exception as e:
         print(f"✗ Error setting up SQL database: {e}")
         raise
 
-    # Get schema information
-    schema_info = get_database_schema(db_path, table_name)
-    schema_description = "Available columns:\n"
-    for col in schema_info:
-        schema_description += f"  - {col['name']} ({col['type']})\n"
+    # Get schema information (cached for the lifetime of the table)
+    try:
+        schema_description = get_schema_description(db_path, table_name, engine)
+    except Exception as e:
+        print(f"✗ Error getting database schema: {e}")
+        schema_description = "Available columns:\n"
 
     # Create SQL query engine
     sql_query_engine = NLSQLTableQueryEngine(
@@ -47,9 +120,16 @@ def setup_sql_tool(db_path="database.sqlite", table_name="data"):
         tables=[table_name],
     )
 
+    # Define the SQL query function
+    async def sql_query_tool(query: str):
+        """Answer a question about the table with generated SQL."""
+        # Query generation and execution block; run them off the event loop
+        response_obj = await asyncio.to_thread(sql_query_engine.query, query)
+        return str(response_obj)
+
     # Create tool for SQL querying with enhanced description
-    sql_tool = QueryEngineTool.from_defaults(
-        query_engine=sql_query_engine,
+    sql_tool = FunctionTool.from_defaults(
+        async_fn=sql_query_tool,
         name="sql_tool",
         description=(
             f"Use this tool to query structured data from the '{table_name}' table. "
@@ -72,8 +152,134 @@ def setup_sql_tool(db_path="database.sqlite", table_name="data"):
     return sql_tool
 
 
-def setup_document_tool(file_dir):
-    """Setup document query tool from directory with simple vector store."""
+def list_directory_files(file_dir):
+    """List the non-hidden regular files in a directory."""
+    return sorted(
+        name for name in os.listdir(file_dir)
+        if not name.startswith(".") and os.path.isfile(os.path.join(file_dir, name))
+    )
+
+
+def get_embed_model_signature(embed_model=None):
+    """Identify an embedder by class, model name, device and precision."""
+    embed_model = embed_model or Settings.embed_model
+    signature = {
+        "class": type(embed_model).__name__,
+        "model_name": getattr(embed_model, "model_name", None),
+        "device": None,
+        "precision": None,
+    }
+
+    # HuggingFaceEmbedding wraps a SentenceTransformer; the ONNX embedder is
+    # identified by its class alone (always FP32 on CPU)
+    model = getattr(embed_model, "_model", None)
+    if model is not None:
+        signature["device"] = str(model.device)
+        if any(".quantized." in type(module).__module__ for module in model.modules()):
+            signature["precision"] = "int8"
+        else:
+            signature["precision"] = str(next(model.parameters()).dtype).replace("torch.", "")
+
+    return signature
+
+
+def get_directory_manifest(file_dir, file_names=None):
+    """Describe the files in a directory (or the given ones) by name, mtime and size."""
+    if file_names is None:
+        file_names = list_directory_files(file_dir)
+
+    files = []
+    for name in file_names:
+        stat = os.stat(os.path.join(file_dir, name))
+        files.append([name, stat.st_mtime, stat.st_size])
+
+    return {
+        "file_dir": os.path.abspath(file_dir),
+        "embed_model": get_embed_model_signature(),
+        "vector_store": VECTOR_STORE_BACKEND,
+        "files": files,
+    }
+
+
+def load_persisted_index(persist_dir, manifest):
+    """Load a persisted vector index if it was built from the same files."""
+    manifest_path = os.path.join(persist_dir, MANIFEST_FILE)
+    if not os.path.exists(manifest_path):
+        return None
+
+    with open(manifest_path, encoding="utf-8") as f:
+        if json.load(f) != manifest:
+            return None
+
+    if manifest["vector_store"] == "faiss":
+        vector_store = FaissVectorStore.from_persist_dir(persist_dir)
+        storage_context = StorageContext.from_defaults(
+            vector_store=vector_store, persist_dir=persist_dir
+        )
+    else:
+        storage_context = StorageContext.from_defaults(persist_dir=persist_dir)
+    return load_index_from_storage(storage_context)
+
+
+@functools.lru_cache(maxsize=1)
+def _faiss_gpu_resources():
+    """Shared FAISS GPU resources; must outlive every GPU index."""
+    return faiss.StandardGpuResources()
+
+
+def move_vector_store_to_gpu(vector_store):
+    """Serve a FAISS index from the GPU when FAISS was built with GPU support."""
+    if faiss is None or not isinstance(vector_store, FaissVectorStore):
+        return
+    if not hasattr(faiss, "StandardGpuResources") or faiss.get_num_gpus() == 0:
+        return
+
+    try:
+        # Done after persisting, since only CPU indexes can be written to disk
+        vector_store._faiss_index = faiss.index_cpu_to_gpu(
+            _faiss_gpu_resources(), 0, vector_store._faiss_index
+        )
+        print("✓ Vector index moved to GPU")
+    except Exception as e:
+        # HNSW indexes have no GPU implementation
+        print(f"⚠️ Keeping vector index on CPU: {e}")
+
+
+def create_vector_store(nodes):
+    """Create a vector store sized for the (already embedded) nodes."""
+    if faiss is None:
+        return SimpleVectorStore()
+
+    # Take the dimension from the embeddings; only probe the model for an empty corpus
+    if nodes and nodes[0].embedding is not None:
+        dim = len(nodes[0].embedding)
+    else:
+        dim = len(Settings.embed_model.get_text_embedding("dimension probe"))
+
+    # Embeddings are normalized, so inner product is cosine similarity
+    if len(nodes) > HNSW_MIN_NODES:
+        faiss_index = faiss.IndexHNSWFlat(dim, 32, faiss.METRIC_INNER_PRODUCT)
+        faiss_index.hnsw.efConstruction = 200
+        faiss_index.hnsw.efSearch = 64
+    else:
+        faiss_index = faiss.IndexFlatIP(dim)
+    return FaissVectorStore(faiss_index=faiss_index)
+
+
+def persist_index(vector_index, persist_dir, manifest):
+    """Persist a vector index together with the manifest of its sources."""
+    # Drop the old manifest first so a partial write is never mistaken for a match
+    manifest_path = os.path.join(persist_dir, MANIFEST_FILE)
+    if os.path.exists(manifest_path):
+        os.remove(manifest_path)
+
+    vector_index.storage_context.persist(persist_dir=persist_dir)
+    with open(manifest_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+
+
+def setup_document_tool(file_dir, input_files=None, persist_dir="storage"):
+    """Setup document query tool from directory with a persisted vector index."""
     if not os.path.exists(file_dir):
         raise FileNotFoundError(f"Document directory not found: {file_dir}")
     
@@ -82,45 +288,25 @@ def setup_document_tool(file_dir):
 
     print(f"📄 Processing documents from: {file_dir}")
 
-    # Create readers and parsers
-    reader = DoclingReader()
-    node_parser = MarkdownNodeParser()
-    
-    # Load documents
+    # Reuse the persisted index when the documents have not changed
+    manifest = get_directory_manifest(file_dir, input_files)
+    vector_index = None
     try:
-        # Use SimpleDirectoryReader without custom extractors for .txt files
-        # It will use the default text reader for .txt files
-        loader = SimpleDirectoryReader(
-            input_dir=file_dir,
-            file_extractor={
-                ".pdf": reader,
-                ".docx": reader,
-                ".pptx": reader,
-                # Don't specify .txt - let SimpleDirectoryReader handle it with default reader
-            },
-        )
-        docs = loader.load_data()
-        print(f"✓ Loaded {len(docs)} documents")
+        vector_index = load_persisted_index(persist_dir, manifest)
     except Exception as e:
-        print(f"✗ Error loading documents: {e}")
-        raise
+        print(f"⚠️ Could not load persisted index, rebuilding: {e}")
 
-    # Create vector store and index
-    try:
-        # Use simple vector store instead of Milvus
-        vector_store = SimpleVectorStore()
-        storage_context = StorageContext.from_defaults(vector_store=vector_store)
-        
-        vector_index = VectorStoreIndex.from_documents(
-            docs,
-            show_progress=True,
-            transformations=[node_parser],
-            storage_context=storage_context,
-        )
-        print("✓ Vector index created")
-    except Exception as e:
-        print(f"✗ Error creating vector index: {e}")
-        raise
+    if vector_index is not None:
+        print(f"✓ Loaded vector index from: {persist_dir}")
+    else:
+        vector_index = build_document_index(file_dir, input_files)
+        try:
+            persist_index(vector_index, persist_dir, manifest)
+            print(f"✓ Vector index saved to: {persist_dir}")
+        except Exception as e:
+            print(f"⚠️ Could not persist vector index: {e}")
+
+    move_vector_store_to_gpu(vector_index.vector_store)
 
     # Custom prompt template for better responses
     template = (
@@ -145,11 +331,12 @@ def setup_document_tool(file_dir):
     )
 
     # Define the document query function
-    def document_query_tool(query: str):
+    async def document_query_tool(query: str):
         """Query documents using semantic search."""
         try:
             print(f"🔍 Searching documents for: {query[:50]}...")
-            response_obj = docs_query_engine.query(query)
+            # Query embedding is CPU-bound; run it off the event loop so timeouts still fire
+            response_obj = await asyncio.to_thread(docs_query_engine.query, query)
             response = str(response_obj)
             print("✓ Document search completed")
             return response
@@ -160,7 +347,7 @@ def setup_document_tool(file_dir):
 
     # Create tool for document querying
     docs_tool = FunctionTool.from_defaults(
-        document_query_tool,
+        async_fn=document_query_tool,
         name="document_tool",
         description=(
             "Use this tool to search and analyze uploaded documents (PDFs, Word docs, etc.). "
@@ -184,27 +371,149 @@ def setup_document_tool(file_dir):
     return docs_tool
 
 
-def get_database_schema(db_path, table_name):
-    """Get schema information for the database table."""
+def load_documents(file_paths):
+    """Load documents, converting PDF/DOCX/PPTX files with Docling in parallel."""
+    docling_paths, other_paths = [], []
+    for path in file_paths:
+        if os.path.splitext(path)[1].lower() in DOCLING_EXTENSIONS:
+            docling_paths.append(path)
+        else:
+            other_paths.append(path)
+
+    docs = []
+    if docling_paths:
+        # Files are independent and Docling's native code releases the GIL.
+        # DocumentConverter is not documented as thread-safe, so each worker
+        # thread gets its own reader.
+        local = threading.local()
+
+        def convert(path):
+            # Like SimpleDirectoryReader (raise_on_error=False), skip files that fail
+            # instead of letting one bad document abort the whole ingest
+            try:
+                if not hasattr(local, "reader"):
+                    local.reader = DoclingReader()
+                file_docs = local.reader.load_data(
+                    file_path=path, extra_info=default_file_metadata_func(path)
+                )
+            except Exception as e:
+                print(f"Failed to load file {path} with error: {e}. Skipping...", flush=True)
+                return []
+            # Same metadata exclusions SimpleDirectoryReader applies to its documents
+            for doc in file_docs:
+                doc.excluded_embed_metadata_keys.extend(EXCLUDED_FILE_METADATA_KEYS)
+                doc.excluded_llm_metadata_keys.extend(EXCLUDED_FILE_METADATA_KEYS)
+            return file_docs
+
+        # Torch already uses half the cores (see initialize_models), so use the rest
+        max_workers = min(
+            len(docling_paths), DOCLING_MAX_WORKERS, max(1, (os.cpu_count() or 2) // 2)
+        )
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for file_docs in executor.map(convert, docling_paths):
+                docs.extend(file_docs)
+
+    if other_paths:
+        # Plain text files are cheap; read them synchronously with the default readers
+        docs.extend(SimpleDirectoryReader(input_files=other_paths).load_data())
+
+    return docs
+
+
+def embed_nodes(nodes):
+    """Embed nodes in length-sorted batches so each batch needs little padding."""
+    # Same text the index would embed, including embed-visible metadata
+    texts = [node.get_content(metadata_mode=MetadataMode.EMBED) for node in nodes]
+    order = sorted(range(len(nodes)), key=lambda i: len(texts[i]))
+
+    embeddings = Settings.embed_model.get_text_embedding_batch(
+        [texts[i] for i in order], show_progress=True
+    )
+    # Assign back by original position; the index skips nodes that already have embeddings
+    for i, embedding in zip(order, embeddings):
+        nodes[i].embedding = embedding
+
+
+def build_document_index(file_dir, input_files=None):
+    """Load documents (all, or the given files) and embed them into a new vector index."""
+    # Create parser
+    node_parser = MarkdownNodeParser()
+    
+    # Load documents
     try:
-        engine = create_engine(f"sqlite:///{db_path}")
+        # Use the already-listed files instead of scanning the directory again
+        if input_files is None:
+            input_files = list_directory_files(file_dir)
+        docs = load_documents([os.path.join(file_dir, name) for name in input_files])
+        print(f"✓ Loaded {len(docs)} documents")
+    except Exception as e:
+        print(f"✗ Error loading documents: {e}")
+        raise
+
+    # Create vector store and index
+    try:
+        nodes = node_parser.get_nodes_from_documents(docs, show_progress=True)
+        embed_nodes(nodes)
+
+        # FAISS flat/HNSW index when available, simple vector store otherwise
+        vector_store = create_vector_store(nodes)
+        storage_context = StorageContext.from_defaults(vector_store=vector_store)
         
-        # Get column information
-        from sqlalchemy import text
-        with engine.connect() as conn:
-            result = conn.execute(text(f"PRAGMA table_info({table_name})"))
-            schema_info = result.fetchall()
-            
-            columns = []
-            for row in schema_info:
-                columns.append({
-                    'name': row[1],
-                    'type': row[2],
-                    'not_null': bool(row[3]),
-                    'primary_key': bool(row[5])
-                })
-            
-            return columns
+        vector_index = VectorStoreIndex(
+            nodes,
+            show_progress=True,
+            storage_context=storage_context,
+        )
+        print(f"✓ Vector index created ({VECTOR_STORE_BACKEND}, {len(nodes)} nodes)")
+    except Exception as e:
+        print(f"✗ Error creating vector index: {e}")
+        raise
+
+    return vector_index
+
+
+@functools.lru_cache(maxsize=8)
+def _read_table_schema(db_path, table_name, engine=None):
+    """Read column information for a table; failures are raised, not cached."""
+    engine = engine or create_sqlite_engine(db_path)
+    
+    # Get column information
+    with engine.connect() as conn:
+        result = conn.execute(text(f"PRAGMA table_info({table_name})"))
+        schema_info = result.fetchall()
+    
+    columns = []
+    for row in schema_info:
+        columns.append({
+            'name': row[1],
+            'type': row[2],
+            'not_null': bool(row[3]),
+            'primary_key': bool(row[5])
+        })
+    
+    return tuple(columns)
+
+
+@functools.lru_cache(maxsize=8)
+def get_schema_description(db_path, table_name, engine=None):
+    """Build the column listing used in the SQL tool description."""
+    schema_description = "Available columns:\n"
+    for col in _read_table_schema(db_path, table_name, engine):
+        schema_description += f"  - {col['name']} ({col['type']})\n"
+    return schema_description
+
+
+def clear_schema_cache():
+    """Forget cached schemas, e.g. after a table has been rebuilt."""
+    _read_table_schema.cache_clear()
+    get_schema_description.cache_clear()
+
+
+def get_database_schema(db_path, table_name, engine=None):
+    """Get schema information for the database table."""
+    try:
+        # Copies, so callers cannot modify the cached entries
+        return [dict(col) for col in _read_table_schema(db_path, table_name, engine)]
     except Exception as e:
         print(f"✗ Error getting database schema: {e}")
         return []
@@ -4,7 +4,12 @@ Simplified version for terminal use
 """
 
 import asyncio
-from typing import Dict, List, Any, Optional
+import contextlib
+import json
+import re
+import uuid
+from collections import deque
+from typing import Deque, Dict, List, Any, Optional
 from llama_index.core import Settings
 from llama_index.core.tools import BaseTool
 from llama_index.core.llms import ChatMessage
@@ -18,6 +23,46 @@ from llama_index.core.workflow import (
     Context,
 )
 
+from semantic_cache import SemanticCache
+
+
+# Tools that hit the SQLite database, and how many of them may run at once
+SQL_TOOL_NAMES = {"sql_tool"}
+MAX_CONCURRENT_SQL_CALLS = 4
+
+# Queries matching exactly one of these are sent to the tool without an LLM routing call
+SQL_ROUTE_PATTERN = re.compile(
+    r"\b(count|sum|avg|average|max|min|how many|list all|birthdays?)\b", re.IGNORECASE
+)
+QUOTED_NAME_PATTERN = re.compile(r'"[A-Z][a-z]+ [A-Z][a-z]+"')
+DOCUMENT_ROUTE_PATTERN = re.compile(
+    r"\b(polic(y|ies)|procedures?|terms|guidelines?)\b", re.IGNORECASE
+)
+
+# Pronouns and phrases that refer back to earlier turns ("her birthday", "what about ...")
+CONTEXT_REFERENCE_PATTERN = re.compile(
+    r"\b(he|she|him|her|his|hers|they|them|their|theirs|it|its|this|that|these|those"
+    r"|same|above|previous|earlier|former|latter|also|too|again|else|other|another)\b"
+    r"|^\s*(and|or|but|so|what about|how about)\b",
+    re.IGNORECASE,
+)
+
+# Results returned when a run fails; callers should not treat these as answers
+CANCELLED_RESPONSE = "The operation was cancelled. Please try again."
+CHAT_ERROR_RESPONSE = (
+    "I encountered an issue processing your request. Please try rephrasing your question."
+)
+TOOL_RESULTS_ERROR_RESPONSE = (
+    "I encountered an issue processing the tool responses. Please try again."
+)
+FALLBACK_RESPONSES = {CANCELLED_RESPONSE, CHAT_ERROR_RESPONSE, TOOL_RESULTS_ERROR_RESPONSE}
+
+
+def is_failed_tool_message(msg: ChatMessage) -> bool:
+    """Whether a tool message reports an error or a cancelled call."""
+    content = (msg.content or "").lower()
+    return "cancelled" in content or "error" in content
+
 
 #####################################
 # Define Events
@@ -56,6 +101,8 @@ class RouterOutputAgentWorkflow(Workflow):
         verbose: bool = False,
         llm: Optional[LLM] = None,
         chat_history: Optional[List[ChatMessage]] = None,
+        max_history: int = 20,
+        fast_routing: bool = True,
     ):
         """Initialize the workflow."""
         super().__init__(
@@ -73,22 +120,77 @@ class RouterOutputAgentWorkflow(Workflow):
         if self.llm is None:
             raise ValueError("No LLM provided and Settings.llm is not initialized")
             
-        self.chat_history: List[ChatMessage] = chat_history or []
+        # The system prompt is kept apart so history truncation can never drop it
+        self._system_msg: Optional[ChatMessage] = None
+        self.chat_history: Deque[ChatMessage] = deque(maxlen=max_history)
+        for msg in chat_history or []:
+            if msg.role == "system":
+                self._system_msg = msg
+            else:
+                self.chat_history.append(msg)
+
+        self.fast_routing = fast_routing
+
+        # Created lazily for the running event loop, see _tool_guard
+        self._sql_semaphore: Optional[asyncio.Semaphore] = None
+        self._sql_semaphore_loop: Optional[asyncio.AbstractEventLoop] = None
 
     def reset(self) -> None:
         """Reset chat history."""
-        self.chat_history = []
+        self.chat_history.clear()
+
+    def add_exchange(self, query: str, response: str) -> None:
+        """Record a question answered outside the workflow (e.g. from a cache)."""
+        self.chat_history.append(ChatMessage(role="user", content=query))
+        self.chat_history.append(ChatMessage(role="assistant", content=response))
+
+    def current_turn_messages(self) -> List[ChatMessage]:
+        """Messages added since the most recent user message."""
+        history = list(self.chat_history)
+        for i in range(len(history) - 1, -1, -1):
+            if history[i].role == "user":
+                return history[i + 1:]
+        return history
+
+    def current_turn_tools_succeeded(self) -> bool:
+        """Whether the latest turn called at least one tool and none of them failed."""
+        tool_msgs = [msg for msg in self.current_turn_messages() if msg.role == "tool"]
+        return bool(tool_msgs) and not any(is_failed_tool_message(msg) for msg in tool_msgs)
+
+    def _llm_messages(self) -> List[ChatMessage]:
+        """Build the messages sent to the LLM: system prompt plus recent history."""
+        history = list(self.chat_history)
+        # Truncation may have split a tool exchange; start at the oldest user message
+        start = next(
+            (i for i, msg in enumerate(history) if msg.role == "user"), len(history)
+        )
+        return [self._system_msg, *history[start:]]
+
+    def is_standalone_query(self, query: str) -> bool:
+        """Whether a new query can be understood without the earlier conversation."""
+        has_prior_turn = any(msg.role == "user" for msg in self.chat_history)
+        return not has_prior_turn or not CONTEXT_REFERENCE_PATTERN.search(query)
+
+    def _fast_route(self, query: str) -> Optional[str]:
+        """Pick a tool for unambiguous queries, or None to let the LLM decide."""
+        wants_sql = bool(SQL_ROUTE_PATTERN.search(query) or QUOTED_NAME_PATTERN.search(query))
+        wants_docs = bool(DOCUMENT_ROUTE_PATTERN.search(query))
+        if wants_sql == wants_docs:
+            return None
+
+        tool_name = "sql_tool" if wants_sql else "document_tool"
+        return tool_name if tool_name in self.tools_dict else None
 
     @step()
-    async def prepare_chat(self, ev: StartEvent) -> InputEvent:
+    async def prepare_chat(self, ev: StartEvent) -> InputEvent | GatherToolsEvent:
         """Prepare the chat by adding user message to history."""
         message = ev.get("message")
         if message is None:
             raise ValueError("'message' field is required.")
 
-        # Add system message if this is the first message (empty chat history)
-        if not self.chat_history:
-            system_msg = ChatMessage(
+        # Create the system message once; it is prepended to every LLM call
+        if self._system_msg is None:
+            self._system_msg = ChatMessage(
                 role="system", 
                 content=(
                     "You are an intelligent assistant with access to two specialized tools:\n\n"
@@ -105,10 +207,43 @@ class RouterOutputAgentWorkflow(Workflow):
                     "- For mixed queries (e.g., 'terms and conditions AND phone owner'), make separate tool calls for each part"
                 )
             )
-            self.chat_history.append(system_msg)
+
+        # Follow-ups need the LLM to resolve references before a tool can be called
+        standalone = self.is_standalone_query(message)
 
         # Add user message to chat history
         self.chat_history.append(ChatMessage(role="user", content=message))
+
+        # Obvious queries skip the routing call; the LLM only phrases the final answer
+        tool_name = self._fast_route(message) if self.fast_routing and standalone else None
+        if tool_name is not None:
+            if self._verbose:
+                print(f"⚡ Routing directly to {tool_name}")
+
+            tool_call = ToolSelection(
+                tool_id=f"call_{uuid.uuid4().hex}",
+                tool_name=tool_name,
+                tool_kwargs={"query": message},
+            )
+            # Record the call as if the LLM had made it, so the tool result has a parent
+            self.chat_history.append(
+                ChatMessage(
+                    role="assistant",
+                    content="",
+                    additional_kwargs={
+                        "tool_calls": [{
+                            "id": tool_call.tool_id,
+                            "type": "function",
+                            "function": {
+                                "name": tool_name,
+                                "arguments": json.dumps(tool_call.tool_kwargs),
+                            },
+                        }]
+                    },
+                )
+            )
+            return GatherToolsEvent(tool_calls=[tool_call])
+
         return InputEvent()
 
     @step()
@@ -121,9 +256,9 @@ class RouterOutputAgentWorkflow(Workflow):
             # Get response from LLM with tools
             chat_res = await self.llm.achat_with_tools(
                 self.tools,
-                chat_history=self.chat_history,
+                chat_history=self._llm_messages(),
                 verbose=self._verbose,
-                allow_parallel_tool_calls=False,
+                allow_parallel_tool_calls=True,
             )
             
             # Extract tool calls
@@ -150,21 +285,30 @@ class RouterOutputAgentWorkflow(Workflow):
             
         except asyncio.CancelledError:
             print("⚠️ Chat operation was cancelled")
-            return StopEvent(result="The operation was cancelled. Please try again.")
+            return StopEvent(result=CANCELLED_RESPONSE)
         except Exception as e:
             error_msg = f"Error during chat: {str(e)}"
             if self._verbose:
                 print(f"❌ {error_msg}")
-            return StopEvent(
-                result="I encountered an issue processing your request. Please try rephrasing your question."
-            )
+            return StopEvent(result=CHAT_ERROR_RESPONSE)
 
     @step(pass_context=True)
-    async def dispatch_calls(self, ctx: Context, ev: GatherToolsEvent) -> ToolCallEvent:
+    async def dispatch_calls(
+        self, ctx: Context, ev: GatherToolsEvent
+    ) -> ToolCallEvent | ToolCallEventResult:
         """Dispatch tool calls to be executed."""
         tool_calls = ev.tool_calls
         await ctx.set("num_tool_calls", len(tool_calls))
 
+        # Several tool calls: run them concurrently and hand the results to gather
+        if len(tool_calls) > 1:
+            msgs = await asyncio.gather(
+                *(self._execute_tool_call(tool_call) for tool_call in tool_calls)
+            )
+            for msg in msgs:
+                ctx.send_event(ToolCallEventResult(msg=msg))
+            return None
+
         # Send tool call events
         for tool_call in tool_calls:
             ctx.send_event(ToolCallEvent(tool_call=tool_call))
@@ -174,66 +318,59 @@ class RouterOutputAgentWorkflow(Workflow):
     @step()
     async def call_tool(self, ev: ToolCallEvent) -> ToolCallEventResult:
         """Execute a tool call."""
+        msg = await self._execute_tool_call(ev.tool_call)
+        return ToolCallEventResult(msg=msg)
+
+    def _tool_guard(self, tool_name: str):
+        """Return the concurrency guard for a tool (limits parallel SQL calls)."""
+        if tool_name not in SQL_TOOL_NAMES:
+            return contextlib.nullcontext()
+
+        # asyncio primitives are bound to one event loop, and each query may run in a new one
+        loop = asyncio.get_running_loop()
+        if self._sql_semaphore_loop is not loop:
+            self._sql_semaphore = asyncio.Semaphore(MAX_CONCURRENT_SQL_CALLS)
+            self._sql_semaphore_loop = loop
+        return self._sql_semaphore
+
+    async def _execute_tool_call(self, tool_call: ToolSelection) -> ChatMessage:
+        """Run a single tool call and wrap its output in a tool message."""
+        tool_id = tool_call.tool_id
         try:
-            tool_call = ev.tool_call
-            tool_id = tool_call.tool_id
-
             if self._verbose:
                 print(f"🔧 Executing {tool_call.tool_name}...")
 
             # Get the tool and call it
             tool = self.tools_dict[tool_call.tool_name]
-            output = await tool.acall(**tool_call.tool_kwargs)
+            async with self._tool_guard(tool_call.tool_name):
+                output = await tool.acall(**tool_call.tool_kwargs)
             
             # Prepare response content
             content = str(output) if output is not None else ""
-            
-            # Create response message
-            msg = ChatMessage(
-                name=tool_call.tool_name,
-                content=content,
-                role="tool",
-                additional_kwargs={
-                    "tool_call_id": tool_id, 
-                    "name": tool_call.tool_name,
-                    "tool_used": tool_call.tool_name
-                },
-            )
 
             if self._verbose:
                 response_preview = content[:100] + "..." if len(content) > 100 else content
                 print(f"✓ {tool_call.tool_name} completed: {response_preview}")
-
-            return ToolCallEventResult(msg=msg)
             
         except asyncio.CancelledError:
             print(f"⚠️ Tool call {tool_call.tool_name} was cancelled")
-            msg = ChatMessage(
-                name=tool_call.tool_name,
-                content="Tool execution was cancelled",
-                role="tool",
-                additional_kwargs={
-                    "tool_call_id": tool_id, 
-                    "name": tool_call.tool_name, 
-                    "tool_used": tool_call.tool_name
-                },
-            )
-            return ToolCallEventResult(msg=msg)
+            content = "Tool execution was cancelled"
         except Exception as e:
-            error_msg = f"Error executing {tool_call.tool_name}: {str(e)}"
+            content = f"Error executing {tool_call.tool_name}: {str(e)}"
             if self._verbose:
-                print(f"❌ {error_msg}")
-            msg = ChatMessage(
-                name=tool_call.tool_name,
-                content=error_msg,
-                role="tool",
-                additional_kwargs={
-                    "tool_call_id": tool_id, 
-                    "name": tool_call.tool_name, 
-                    "tool_used": tool_call.tool_name
-                },
-            )
-            return ToolCallEventResult(msg=msg)
+                print(f"❌ {content}")
+
+        # Create response message
+        return ChatMessage(
+            name=tool_call.tool_name,
+            content=content,
+            role="tool",
+            additional_kwargs={
+                "tool_call_id": tool_id, 
+                "name": tool_call.tool_name,
+                "tool_used": tool_call.tool_name
+            },
+        )
 
     @step(pass_context=True)
     async def gather(self, ctx: Context, ev: ToolCallEventResult) -> StopEvent | None:
@@ -261,9 +398,7 @@ class RouterOutputAgentWorkflow(Workflow):
             error_msg = f"Error gathering tool results: {str(e)}"
             if self._verbose:
                 print(f"❌ {error_msg}")
-            return StopEvent(
-                result="I encountered an issue processing the tool responses. Please try again."
-            )
+            return StopEvent(result=TOOL_RESULTS_ERROR_RESPONSE)
 
 
 def create_workflow(tools: List[BaseTool], verbose: bool = False) -> RouterOutputAgentWorkflow:
@@ -280,15 +415,33 @@ def create_workflow(tools: List[BaseTool], verbose: bool = False) -> RouterOutpu
         raise
 
 
-async def run_query(workflow: RouterOutputAgentWorkflow, query: str) -> str:
+async def run_query(
+    workflow: RouterOutputAgentWorkflow,
+    query: str,
+    cache: Optional[SemanticCache] = None,
+) -> str:
     """Run a single query through the workflow."""
     try:
         # Clear chat history for fresh query
         workflow.reset()
         
+        # Answer near-duplicate questions from the cache
+        cached = cache.lookup(query) if cache is not None else None
+        if cached is not None:
+            workflow.add_exchange(query, cached)
+            return cached
+        
         # Run the workflow
-        result = await workflow.run(message=query)
-        return str(result)
+        result = str(await workflow.run(message=query))
+        
+        # Only cache answers backed by successful tool calls
+        if (
+            cache is not None
+            and result not in FALLBACK_RESPONSES
+            and workflow.current_turn_tools_succeeded()
+        ):
+            cache.add(query, result)
+        return result
         
     except Exception as e:
         error_msg = f"Error running query: {str(e)}"